@@ -4,44 +4,196 @@
 # This is for https://readnovelfull.com site.
 
 import requests
-from bs4 import BeautifulSoup
-import pandas as pd
+from requests.adapters import HTTPAdapter
+import lxml.html
+from lxml.etree import HTMLPullParser, ParserError, XMLSyntaxError, XPath, strip_elements
 from ebooklib import epub
+from concurrent.futures import ThreadPoolExecutor
+import queue
+import threading
 import time
 import argparse
+import itertools
+import logging
+from logging.handlers import QueueHandler, QueueListener
+import hashlib
+import json
+import os
+from html import escape
 import re
+import codecs
+import sys
+
+logger = logging.getLogger(__name__)
+
+def setup_logging():
+    """
+    Sends log messages through a queue so worker threads never wait on stdout.
+    Returns the listener thread writing them out; stop it before exiting to flush the queue.
+    """
+    log_queue = queue.Queue()
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    listener = QueueListener(log_queue, handler)
+    root_logger = logging.getLogger()
+    root_logger.addHandler(QueueHandler(log_queue))
+    root_logger.setLevel(logging.INFO)
+    listener.start()
+    return listener
 
 # Set up headers to mimic a browser request
 headers = {
     'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
 }
 
-# Function to get the list of chapter links (with AJAX support)
-def get_chapter_links(novel_url):
+# Reuse one session for every request so the connection to the site stays open
+SESSION = requests.Session()
+SESSION.headers.update(headers)
+
+# Number of chapters fetched in parallel (override with --workers)
+MAX_WORKERS = 8
+
+def size_connection_pool(max_workers):
+    """
+    Mounts a connection pool large enough for every worker to keep its own connection.
+    """
+    SESSION.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=max(20, max_workers)))
+
+size_connection_pool(MAX_WORKERS)
+
+# Maximum number of requests per second across all workers (override with --rps)
+REQUESTS_PER_SECOND = 5
+
+class RateLimiter:
+    """
+    Spaces requests out to at most `rate` per second, shared by every worker thread.
+    A rate of 0 or less disables the limit.
     """
-    Fetches chapter links from the novel's main page, including chapters loaded via AJAX.
+    def __init__(self, rate):
+        self._interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        # Reserve the next free slot under the lock, then sleep outside it
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self._interval
+        if delay > 0:
+            time.sleep(delay)
+
+LIMITER = RateLimiter(REQUESTS_PER_SECOND)
+
+def fetch(url, **kwargs):
     """
-    response = requests.get(novel_url, headers=headers)
-    soup = BeautifulSoup(response.content, 'html.parser')
+    Waits for the rate limiter, then GETs the URL with the shared session.
+    """
+    LIMITER.wait()
+    return SESSION.get(url, **kwargs)
+
+# Size of the chunks streamed from the network into the incremental HTML parser
+PARSE_CHUNK_SIZE = 16 * 1024
 
-    # Get the novel ID from the page (needed for AJAX requests)
-    novel_id_tag = soup.select_one('#rating')
-    novel_id = novel_id_tag['data-novel-id'] if novel_id_tag else None
+# Finds a charset declared in a <meta> tag near the top of a page
+_META_CHARSET_RE = re.compile(rb'<meta[^>]+charset\s*=', re.IGNORECASE)
+
+def guess_encoding(response, head):
+    """
+    Picks the encoding to parse a page with, given the first bytes of its body.
+    Uses the charset from the HTTP header if there is a known one; otherwise lets lxml read a <meta> charset,
+    and falls back to UTF-8 rather than lxml's default of Latin-1.
+    """
+    if 'charset' in response.headers.get('Content-Type', '').lower():
+        try:
+            codecs.lookup(response.encoding)
+            return response.encoding
+        except LookupError:
+            pass  # An unknown name like "utf8mb4" would make lxml raise, so ignore the header
+    if _META_CHARSET_RE.search(head[:PARSE_CHUNK_SIZE]):
+        return None
+    return 'utf-8'
+
+# Parsed novel and AJAX pages, kept for the life of the process
+_PAGE_CACHE = {}
+
+def _fetch_and_parse(url):
+    """
+    Fetches and parses a page the first time it is asked for, then returns the cached tree.
+    An empty or unparseable page comes back as an empty tree.
+    """
+    if url not in _PAGE_CACHE:
+        response = fetch(url)
+        parser = lxml.html.HTMLParser(encoding=guess_encoding(response, response.content))
+        try:
+            _PAGE_CACHE[url] = lxml.html.fromstring(response.content, parser=parser)
+        except (ParserError, XMLSyntaxError):
+            _PAGE_CACHE[url] = lxml.html.Element('html')
+    return _PAGE_CACHE[url]
+
+def has_class(name):
+    """
+    Builds an XPath predicate matching elements with the given CSS class.
+    """
+    return f'contains(concat(" ", normalize-space(@class), " "), " {name} ")'
+
+# XPath queries for the novel and AJAX pages, compiled once instead of on every call
+_RATING_XP = XPath('//*[@id="rating"]')
+_CHAPTER_LINKS_XP = XPath(f'//*[{has_class("list-chapter")}]//a/@href', smart_strings=False)
+_NOVEL_TITLE_XP = XPath(f'//h3[{has_class("title")}]')
+_AUTHOR_XP = XPath(f'//ul[{has_class("info-meta")}]//a[contains(@href, "/authors/")]')
+
+# XPath queries for the chapter pages, compiled once and reused for every chapter
+_TITLE_XP = XPath(f'//h2//a[{has_class("chr-title")}]//span[{has_class("chr-text")}]')
+_CONTENT_XP = XPath('//div[@id="chr-content"]')
+_PARAGRAPHS_XP = XPath('.//p')
+# True if the chapter body has any non-blank text outside its <p> tags
+_LOOSE_TEXT_XP = XPath('boolean(.//text()[normalize-space()][not(ancestor::p)])')
+
+def parse_until(response, is_target):
+    """
+    Parses a streamed response chunk by chunk and stops once is_target() matches a closed <div>.
+    Returns the root of the document parsed so far.
+    """
+    chunks = response.iter_content(PARSE_CHUNK_SIZE)
+    first_chunk = next(chunks, b'')
+    parser = HTMLPullParser(events=('end',), tag='div', encoding=guess_encoding(response, first_chunk))
+    parser.set_element_class_lookup(lxml.html.HtmlElementClassLookup())
+    try:
+        for chunk in itertools.chain([first_chunk], chunks):
+            parser.feed(chunk)
+            if any(is_target(element) for _, element in parser.read_events()):
+                break
+        tree = parser.close()
+    except (ParserError, XMLSyntaxError):
+        tree = None
+    if tree is None:
+        # An empty or unparseable page is treated as a page without any content
+        tree = lxml.html.Element('html')
+    # Read the rest of the body so the connection can go back to the pool
+    for _ in chunks:
+        pass
+    return tree
+
+# Function to get the list of chapter links (with AJAX support)
+def get_chapter_links(novel_id):
+    """
+    Fetches chapter links from the AJAX chapter archive for the given novel ID.
+    """
     if not novel_id:
-        print("Failed to find novel ID.")
+        logger.warning("Failed to find novel ID.")
         return []
 
     # Collect chapters loaded via AJAX
     ajax_url = f"https://readnovelfull.com/ajax/chapter-archive?novelId={novel_id}"
-    response = requests.get(ajax_url, headers=headers)
-    soup = BeautifulSoup(response.content, 'html.parser')
+    tree = _fetch_and_parse(ajax_url)
 
     # Find chapter links in the AJAX response
     chapters = []
-    chapter_list = soup.select('.list-chapter a')  # Selector for chapter links in AJAX
+    chapter_hrefs = _CHAPTER_LINKS_XP(tree)  # Selector for chapter links in AJAX
 
-    for chapter in chapter_list:
-        chapter_url = "https://readnovelfull.com" + chapter['href']
+    for chapter_href in chapter_hrefs:
+        chapter_url = "https://readnovelfull.com" + chapter_href
         chapters.append(chapter_url)
 
     return chapters
@@ -49,78 +201,144 @@ def get_chapter_links(novel_url):
 # Function to scrape the content of each chapter
 def scrape_chapter(chapter_url):
     """
-    Scrapes the chapter title and content.
+    Scrapes the chapter title and content (as a list of paragraphs).
     """
-    response = requests.get(chapter_url, headers=headers)
-    soup = BeautifulSoup(response.content, 'html.parser')
+    # Parse the page while it downloads, stopping at the end of the chapter body
+    with fetch(chapter_url, stream=True) as response:
+        tree = parse_until(response, lambda element: element.get('id') == 'chr-content')
 
     # Try to get the chapter title (within an 'a' tag inside an 'h2' tag)
-    chapter_title_tag = soup.select_one('h2 a.chr-title span.chr-text')
-    chapter_title = chapter_title_tag.get_text(strip=True) if chapter_title_tag else None
+    chapter_title_tags = _TITLE_XP(tree)
+    chapter_title = chapter_title_tags[0].text_content().strip() if chapter_title_tags else None
 
     # If the title isn't found, try a fallback method using regex
     if not chapter_title:
-        print(f"Failed to find title for {chapter_url}")
+        logger.warning("Failed to find title for %s", chapter_url)
         chapter_title = "Unknown Chapter"
 
     # Try to get the chapter content
-    chapter_content_tag = soup.find('div', id='chr-content')
-    if chapter_content_tag:
-        chapter_content = chapter_content_tag.get_text(separator='\n').strip()
+    chapter_content_tags = _CONTENT_XP(tree)
+    if chapter_content_tags:
+        content_tag = chapter_content_tags[0]
+        # Drop inline scripts and styles once so their text isn't picked up below
+        strip_elements(content_tag, 'script', 'style', with_tail=False)
+        if _LOOSE_TEXT_XP(content_tag):
+            # Some text sits outside <p> tags (bare text, <br> lines, <div> blocks),
+            # so keep every piece of text in the body, each as its own paragraph
+            paragraphs = [text.strip() for text in content_tag.itertext()]
+        else:
+            paragraphs = [p.text_content().strip() for p in _PARAGRAPHS_XP(content_tag)]
+        chapter_content = [paragraph for paragraph in paragraphs if paragraph]
     else:
-        print(f"Failed to find content for {chapter_url}")
+        logger.warning("Failed to find content for %s", chapter_url)
         return None, None
 
     return chapter_title, chapter_content
 
-# Function to get the author and title of the novel from the main page
-def get_novel_info(novel_url):
+# Novel info is cached on disk so repeat runs can skip the novel's main page
+META_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'novel-scraper')
+META_CACHE_TTL = 7 * 24 * 60 * 60  # Seconds before a cached entry is fetched again
+
+def _meta_cache_path(novel_url):
+    """
+    Returns the cache file path for a novel URL.
+    """
+    url_hash = hashlib.sha256(novel_url.encode('utf-8')).hexdigest()
+    return os.path.join(META_CACHE_DIR, f'{url_hash}.json')
+
+def load_cached_meta(novel_url):
+    """
+    Returns the cached (title, author, novel ID) for a novel, or None if missing or expired.
+    """
+    path = _meta_cache_path(novel_url)
+    try:
+        if time.time() - os.path.getmtime(path) > META_CACHE_TTL:
+            return None
+        with open(path, encoding='utf-8') as f:
+            meta = json.load(f)
+        return meta['title'], meta['author'], meta['novel_id']
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+def save_cached_meta(novel_url, novel_title, author_name, novel_id):
+    """
+    Writes the novel's title, author and ID to the cache; failures are ignored.
+    """
+    try:
+        os.makedirs(META_CACHE_DIR, exist_ok=True)
+        with open(_meta_cache_path(novel_url), 'w', encoding='utf-8') as f:
+            json.dump({'title': novel_title, 'author': author_name, 'novel_id': novel_id}, f)
+    except OSError:
+        pass
+
+# Function to get the title, author and ID of the novel from the main page
+def get_novel_meta(novel_url):
     """
-    Scrapes the title and author from the novel's main page.
+    Scrapes the title, author and novel ID (needed for AJAX requests) from the novel's main page.
+    A recent cached copy is used instead of fetching the page when available.
     """
-    response = requests.get(novel_url, headers=headers)
-    soup = BeautifulSoup(response.content, 'html.parser')
+    cached_meta = load_cached_meta(novel_url)
+    if cached_meta:
+        return cached_meta
+
+    tree = _fetch_and_parse(novel_url)
 
     # Extract the title
-    title_tag = soup.select_one('h3.title')
-    novel_title = title_tag.get_text(strip=True) if title_tag else "Unknown Title"
+    title_tags = _NOVEL_TITLE_XP(tree)
+    novel_title = title_tags[0].text_content().strip() if title_tags else "Unknown Title"
 
     # Extract the author
-    author_tag = soup.select_one('ul.info-meta a[href*="/authors/"]')
-    author_name = author_tag.get_text(strip=True) if author_tag else "Unknown Author"
+    author_tags = _AUTHOR_XP(tree)
+    author_name = author_tags[0].text_content().strip() if author_tags else "Unknown Author"
+
+    # Extract the novel ID
+    novel_id_tags = _RATING_XP(tree)
+    novel_id = novel_id_tags[0].get('data-novel-id') if novel_id_tags else None
+
+    # Only cache pages that gave us an ID, so a failed fetch is retried next run
+    if novel_id:
+        save_cached_meta(novel_url, novel_title, author_name, novel_id)
 
-    return novel_title, author_name
+    return novel_title, author_name, novel_id
+
+# Function to scrape a single chapter without letting one failure stop the whole run
+def scrape_chapter_safe(chapter_url):
+    """
+    Scrapes a chapter, returning (None, None) if the request fails.
+    """
+    try:
+        return scrape_chapter(chapter_url)
+    except Exception as e:
+        logger.error("Failed to scrape %s: %s", chapter_url, e)
+        return None, None
 
 # Function to scrape the entire novel
-def scrape_novel(novel_url, limit=None, scrape_all=False):
+def scrape_novel(novel_id, chapter_queue, limit=None, scrape_all=False, max_workers=MAX_WORKERS):
     """
-    Scrapes all chapters or up to a specified limit and saves to a DataFrame.
+    Scrapes all chapters or up to a specified limit, putting each one on chapter_queue as a dict.
     """
-    chapters = get_chapter_links(novel_url)
-    novel_data = []
+    chapters = get_chapter_links(novel_id)
 
     # Determine how many chapters to scrape
     if scrape_all:
         limit = len(chapters)  # Set limit to total number of chapters if --all is used
 
-    # Loop through the chapters and scrape the content
-    for i, chapter_url in enumerate(chapters[:limit]):
-        try:
-            title, content = scrape_chapter(chapter_url)
+    # Fetch the chapters in parallel; map() yields results in chapter order
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = executor.map(scrape_chapter_safe, chapters[:limit])
+        for i, (title, content) in enumerate(results):
             if title and content:
-                print(f'Scraping chapter {i+1}: {title}')
-                novel_data.append({'title': title, 'content': content})
-            time.sleep(1)  # Sleep between requests to avoid hammering the server
-        except Exception as e:
-            print(f"Failed to scrape {chapter_url}: {e}")
-            continue
+                logger.info('Scraping chapter %d: %s', i + 1, title)
+                chapter_queue.put({'title': title, 'content': content})
 
-    return pd.DataFrame(novel_data)
+# Put on chapter_queue instead of None when scraping fails, so no partial EPUB is written
+SCRAPE_FAILED = object()
 
 # Function to create an EPUB book from the scraped data
-def create_epub(novel_df, novel_title, author_name, output_filename):
+def create_epub(chapter_queue, novel_title, author_name, output_filename):
     """
-    Creates an EPUB file from a DataFrame containing novel chapters.
+    Creates an EPUB file, adding chapters as they arrive on chapter_queue until it receives None.
+    Returns without writing anything if it receives SCRAPE_FAILED instead.
     """
     # Initialize the EPUB book
     book = epub.EpubBook()
@@ -131,20 +349,25 @@ def create_epub(novel_df, novel_title, author_name, output_filename):
     book.set_language('en')
     book.add_author(author_name)
 
-    # Loop through the CSV rows and add each chapter as a section in the EPUB
-    for i, row in novel_df.iterrows():
+    # Loop through the chapters and add each one as a section and TOC entry in the EPUB
+    toc_entries = []
+    for i, row in enumerate(iter(chapter_queue.get, None)):
+        if row is SCRAPE_FAILED:
+            return
         chapter = epub.EpubHtml(title=row['title'], file_name=f'chap_{i+1}.xhtml', lang='en')
         
-        # Handle the chapter content and formatting
-        chapter_content = row['content'].replace("\n", "<br>")  # Convert newlines to HTML breaks
-        chapter.content = f'<h1>{row["title"]}</h1><p>{chapter_content}</p>'
+        # Build the chapter HTML in one pass, one <p> per paragraph
+        html_parts = ['<h1>', escape(row['title']), '</h1>']
+        html_parts.extend(f'<p>{escape(paragraph)}</p>' for paragraph in row['content'])
+        chapter.content = ''.join(html_parts)
         
         # Add chapter to the book
         book.add_item(chapter)
         book.spine.append(chapter)
+        toc_entries.append(epub.Link(f'chap_{i+1}.xhtml', row['title'], f'chap_{i+1}'))
 
     # Define the Table of Contents
-    book.toc = tuple([epub.Link(f'chap_{i+1}.xhtml', row['title'], f'chap_{i+1}') for i, row in novel_df.iterrows()])
+    book.toc = tuple(toc_entries)
     
     # Add NCX and Navigation (for EPUB readers)
     book.add_item(epub.EpubNcx())
@@ -155,28 +378,34 @@ def create_epub(novel_df, novel_title, author_name, output_filename):
     nav_css = epub.EpubItem(uid="style_nav", file_name="style/nav.css", media_type="text/css", content=style)
     book.add_item(nav_css)
 
-    # Save the EPUB file
-    epub.write_epub(output_filename, book, {})
+    # Save the EPUB file; the chapters have no page-break markers, so skip ebooklib's scan for them
+    epub.write_epub(output_filename, book, {'epub3_pages': False})
 
 # Function to scrape a novel and convert it to an EPUB
-def scrape_and_convert_to_epub(novel_url, limit=None, scrape_all=False):
+def scrape_and_convert_to_epub(novel_url, limit=None, scrape_all=False, max_workers=MAX_WORKERS):
     """
     Scrapes a novel and converts it to an EPUB file.
     """
-    # Scrape the novel info (title and author)
-    novel_title, author_name = get_novel_info(novel_url)
-    print(f"Novel: {novel_title}, Author: {author_name}")
-
-    # Scrape the novel chapters
-    novel_df = scrape_novel(novel_url, limit=limit, scrape_all=scrape_all)
+    # Scrape the novel info (title, author and ID) in one request
+    novel_title, author_name, novel_id = get_novel_meta(novel_url)
+    logger.info("Novel: %s, Author: %s", novel_title, author_name)
 
     # Generate the output filename based on the title
     output_epub = f'{novel_title.replace(" ", "_").lower()}.epub'
-    
-    # Create the EPUB file
-    create_epub(novel_df, novel_title, author_name, output_epub)
 
-    print(f"Scraping and EPUB conversion complete! EPUB saved as '{output_epub}'")
+    # Build the EPUB in a background thread while the chapters are still being scraped
+    chapter_queue = queue.Queue()
+    with ThreadPoolExecutor(max_workers=1) as writer:
+        epub_future = writer.submit(create_epub, chapter_queue, novel_title, author_name, output_epub)
+        try:
+            scrape_novel(novel_id, chapter_queue, limit=limit, scrape_all=scrape_all, max_workers=max_workers)
+        except BaseException:
+            chapter_queue.put(SCRAPE_FAILED)  # Tell the writer to give up without saving
+            raise
+        chapter_queue.put(None)  # Tell the writer there are no more chapters
+        epub_future.result()  # Re-raise any error from the writer
+
+    logger.info("Scraping and EPUB conversion complete! EPUB saved as '%s'", output_epub)
 
 # Command-line argument parsing
 if __name__ == "__main__":
@@ -184,11 +413,21 @@ if __name__ == "__main__":
     parser.add_argument('novel_url', type=str, help='URL of the novel to scrape (e.g., https://readnovelfull.com/heaven-officials-blessing-novel.html)')
     parser.add_argument('--limit', type=int, default=None, help='Limit the number of chapters to scrape (default: scrape all chapters)')
     parser.add_argument('--all', action='store_true', help='Scrape all chapters (overrides limit)')
+    parser.add_argument('--workers', type=int, default=MAX_WORKERS, help=f'Number of chapters to fetch in parallel (default: {MAX_WORKERS})')
+    parser.add_argument('--rps', type=float, default=REQUESTS_PER_SECOND, help=f'Maximum requests per second, 0 for no limit (default: {REQUESTS_PER_SECOND})')
 
     args = parser.parse_args()
     novel_url = args.novel_url
     limit = args.limit
     scrape_all = args.all
+    max_workers = max(1, args.workers)
+    size_connection_pool(max_workers)
+    LIMITER = RateLimiter(args.rps)
+    log_listener = setup_logging()
 
     # Call the scraping and EPUB conversion function
-    scrape_and_convert_to_epub(novel_url, limit=limit, scrape_all=scrape_all)
+    try:
+        scrape_and_convert_to_epub(novel_url, limit=limit, scrape_all=scrape_all, max_workers=max_workers)
+    finally:
+        SESSION.close()
+        log_listener.stop()
@@ -3,96 +3,256 @@
 
 
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+import lxml.html
+from lxml.etree import HTMLPullParser, ParserError, XMLSyntaxError, XPath
+from concurrent.futures import ThreadPoolExecutor
+import queue
+import threading
 import time
 import argparse
+import itertools
+import logging
+from logging.handlers import QueueHandler, QueueListener
+from html import escape
 import re
+import codecs
+import sys
 import os
 import ebooklib
 from ebooklib import epub
 
+logger = logging.getLogger(__name__)
+
+def setup_logging():
+    """
+    Sends log messages through a queue so worker threads never wait on stdout.
+    Returns the listener thread writing them out; stop it before exiting to flush the queue.
+    """
+    log_queue = queue.Queue()
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    listener = QueueListener(log_queue, handler)
+    root_logger = logging.getLogger()
+    root_logger.addHandler(QueueHandler(log_queue))
+    root_logger.setLevel(logging.INFO)
+    listener.start()
+    return listener
+
 # Set up headers to mimic a browser request
 headers = {
     'User-Agent': 'Mozilla/50 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
 }
 
-def scrape_chapter(url):
+# Reuse one session for every request so the connection to the site stays open
+SESSION = requests.Session()
+SESSION.headers.update(headers)
+
+# Matches the chapter number at the end of a chapter URL
+_CHAPTER_NUM_RE = re.compile(r'/chapter-(\d+)/$')
+
+# Number of chapters fetched in parallel (override with --workers)
+MAX_WORKERS = 8
+
+def size_connection_pool(max_workers):
     """
-    Scrapes the title and content from a single chapter URL.
+    Mounts a connection pool large enough for every worker to keep its own connection.
     """
-    print(f"Scraping chapter from: {url}")
+    SESSION.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=max(20, max_workers)))
+
+size_connection_pool(MAX_WORKERS)
+
+# Maximum number of requests per second across all workers (override with --rps)
+REQUESTS_PER_SECOND = 5
+
+class RateLimiter:
+    """
+    Spaces requests out to at most `rate` per second, shared by every worker thread.
+    A rate of 0 or less disables the limit.
+    """
+    def __init__(self, rate):
+        self._interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        # Reserve the next free slot under the lock, then sleep outside it
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self._interval
+        if delay > 0:
+            time.sleep(delay)
+
+LIMITER = RateLimiter(REQUESTS_PER_SECOND)
+
+def fetch(url, **kwargs):
+    """
+    Waits for the rate limiter, then GETs the URL with the shared session.
+    """
+    LIMITER.wait()
+    return SESSION.get(url, **kwargs)
+
+# Size of the chunks streamed from the network into the incremental HTML parser
+PARSE_CHUNK_SIZE = 16 * 1024
+
+# Finds a charset declared in a <meta> tag near the top of a page
+_META_CHARSET_RE = re.compile(rb'<meta[^>]+charset\s*=', re.IGNORECASE)
+
+def guess_encoding(response, head):
+    """
+    Picks the encoding to parse a page with, given the first bytes of its body.
+    Uses the charset from the HTTP header if there is a known one; otherwise lets lxml read a <meta> charset,
+    and falls back to UTF-8 rather than lxml's default of Latin-1.
+    """
+    if 'charset' in response.headers.get('Content-Type', '').lower():
+        try:
+            codecs.lookup(response.encoding)
+            return response.encoding
+        except LookupError:
+            pass  # An unknown name like "utf8mb4" would make lxml raise, so ignore the header
+    if _META_CHARSET_RE.search(head[:PARSE_CHUNK_SIZE]):
+        return None
+    return 'utf-8'
+
+# Parsed novel pages, kept for the life of the process
+_PAGE_CACHE = {}
+
+def _fetch_and_parse(url):
+    """
+    Fetches and parses a page the first time it is asked for, then returns the cached tree.
+    An empty or unparseable page comes back as an empty tree.
+    """
+    if url not in _PAGE_CACHE:
+        response = fetch(url)
+        parser = lxml.html.HTMLParser(encoding=guess_encoding(response, response.content))
+        try:
+            _PAGE_CACHE[url] = lxml.html.fromstring(response.content, parser=parser)
+        except (ParserError, XMLSyntaxError):
+            _PAGE_CACHE[url] = lxml.html.Element('html')
+    return _PAGE_CACHE[url]
+
+def has_class(name):
+    """
+    Builds an XPath predicate matching elements with the given CSS class.
+    """
+    return f'contains(concat(" ", normalize-space(@class), " "), " {name} ")'
+
+# XPath queries for the novel page, compiled once instead of on every call
+_READ_LAST_XP = XPath('//a[@id="btn-read-last"]')
+_READ_FIRST_XP = XPath('//a[@id="btn-read-first"]')
+_NOVEL_TITLE_XP = XPath(f'//h1[{has_class("post-title")}]')
+
+# XPath queries for the chapter pages, compiled once and reused for every chapter
+_CONTENT_XP = XPath(f'//div[{has_class("text-left")}]')
+_PARAGRAPHS_XP = XPath('.//p')
+
+def parse_until(response, is_target):
+    """
+    Parses a streamed response chunk by chunk and stops once is_target() matches a closed <div>.
+    Returns the root of the document parsed so far.
+    """
+    chunks = response.iter_content(PARSE_CHUNK_SIZE)
+    first_chunk = next(chunks, b'')
+    parser = HTMLPullParser(events=('end',), tag='div', encoding=guess_encoding(response, first_chunk))
+    parser.set_element_class_lookup(lxml.html.HtmlElementClassLookup())
+    try:
+        for chunk in itertools.chain([first_chunk], chunks):
+            parser.feed(chunk)
+            if any(is_target(element) for _, element in parser.read_events()):
+                break
+        tree = parser.close()
+    except (ParserError, XMLSyntaxError):
+        tree = None
+    if tree is None:
+        # An empty or unparseable page is treated as a page without any content
+        tree = lxml.html.Element('html')
+    # Read the rest of the body so the connection can go back to the pool
+    for _ in chunks:
+        pass
+    return tree
+
+def scrape_chapter(url, chapter_num=None):
+    """
+    Scrapes the title and content (as a list of paragraphs) from a single chapter URL.
+    The chapter number is read from the URL unless it is passed in.
+    """
+    logger.info("Scraping chapter from: %s", url)
     try:
-        response = requests.get(url, headers=headers)
-        response.raise_for_status() # Raise an exception for bad status codes
-        soup = BeautifulSoup(response.content, 'html.parser')
+        # Parse the page while it downloads, stopping at the end of the chapter body
+        with fetch(url, stream=True) as response:
+            response.raise_for_status() # Raise an exception for bad status codes
+            tree = parse_until(response, lambda element: 'text-left' in element.get('class', '').split())
 
-        # Extract the chapter number from the URL to use as the title
-        match = re.search(r'/chapter-(\d+)/$', url)
-        title = f"Chapter {match.group(1)}" if match else "Unknown Title"
+        # Use the chapter number as the title, extracting it from the URL if needed
+        if chapter_num is None:
+            match = _CHAPTER_NUM_RE.search(url)
+            chapter_num = match.group(1) if match else None
+        title = f"Chapter {chapter_num}" if chapter_num is not None else "Unknown Title"
 
         # Find the content of the chapter
-        content_div = soup.select_one('div.text-left')
-        content_text = ""
-        if content_div:
+        content_divs = _CONTENT_XP(tree)
+        paragraphs = []
+        if content_divs:
             # We are interested in the text within <p> tags
-            paragraphs = content_div.find_all('p')
-            content_text = '\n\n'.join(p.text.strip() for p in paragraphs)
+            paragraphs = [p.text_content().strip() for p in _PARAGRAPHS_XP(content_divs[0])]
+            paragraphs = [paragraph for paragraph in paragraphs if paragraph]
         
-        if not content_text:
-            print(f"Warning: No content found for chapter at {url}")
+        if not paragraphs:
+            logger.warning("Warning: No content found for chapter at %s", url)
 
         return {
             'title': title,
-            'content': content_text
+            'content': paragraphs
         }
 
     except requests.exceptions.RequestException as e:
-        print(f"Error fetching URL {url}: {e}")
+        logger.error("Error fetching URL %s: %s", url, e)
         return None
 
 def get_chapter_links(novel_url):
     """
     Fetches all chapter links by generating them from the URL pattern.
+    Returns a list of (chapter_num, chapter_url) pairs.
     """
-    print("Fetching novel information...")
-    response = requests.get(novel_url, headers=headers)
-    soup = BeautifulSoup(response.content, 'html.parser')
+    logger.info("Fetching novel information...")
+    tree = _fetch_and_parse(novel_url)
 
     # Find the 'Read First' and 'Read Last' buttons to get the chapter range
-    first_chapter_link_tag = soup.select_one('a#btn-read-last')
-    last_chapter_link_tag = soup.select_one('a#btn-read-first')
+    first_chapter_link_tags = _READ_LAST_XP(tree)
+    last_chapter_link_tags = _READ_FIRST_XP(tree)
     
     start_chapter = None
     end_chapter = None
     
-    if first_chapter_link_tag:
-        first_chapter_url = first_chapter_link_tag.get('href')
+    if first_chapter_link_tags:
+        first_chapter_url = first_chapter_link_tags[0].get('href')
         if first_chapter_url:
-            match = re.search(r'/chapter-(\d+)/$', first_chapter_url)
+            match = _CHAPTER_NUM_RE.search(first_chapter_url)
             if match:
                 start_chapter = int(match.group(1))
 
-    if last_chapter_link_tag:
-        last_chapter_url = last_chapter_link_tag.get('href')
+    if last_chapter_link_tags:
+        last_chapter_url = last_chapter_link_tags[0].get('href')
         if last_chapter_url:
-            match = re.search(r'/chapter-(\d+)/$', last_chapter_url)
+            match = _CHAPTER_NUM_RE.search(last_chapter_url)
             if match:
                 end_chapter = int(match.group(1))
 
     if not start_chapter or not end_chapter:
-        print("Failed to find chapter range.")
+        logger.warning("Failed to find chapter range.")
         return []
     
-    print(f"Starting chapter found: {start_chapter}")
-    print(f"Ending chapter found: {end_chapter}")
+    logger.info("Starting chapter found: %d", start_chapter)
+    logger.info("Ending chapter found: %d", end_chapter)
 
     # Generate the URLs directly.
     base_url = novel_url.rstrip('/')
     chapters = []
     for chapter_num in range(start_chapter, end_chapter + 1):
-        chapters.append(f"{base_url}/chapter-{chapter_num}/")
+        chapters.append((chapter_num, f"{base_url}/chapter-{chapter_num}/"))
         
-    print(f"Generated {len(chapters)} chapter links.")
+    logger.info("Generated %d chapter links.", len(chapters))
     
     return chapters
 
@@ -101,22 +261,25 @@ def get_novel_title(novel_url):
     Scrapes the novel's title from the main page.
     """
     try:
-        response = requests.get(novel_url, headers=headers)
-        response.raise_for_status()
-        soup = BeautifulSoup(response.content, 'html.parser')
-        title_tag = soup.select_one('h1.post-title')
-        if title_tag:
-            return title_tag.text.strip()
+        tree = _fetch_and_parse(novel_url)
+        title_tags = _NOVEL_TITLE_XP(tree)
+        if title_tags:
+            return title_tags[0].text_content().strip()
     except requests.exceptions.RequestException as e:
-        print(f"Error fetching novel title: {e}")
+        logger.error("Error fetching novel title: %s", e)
     return "Unknown Novel"
 
 
-def create_epub(novel_data, novel_title, novel_author, output_filename):
+# Put on chapter_queue instead of None when scraping fails, so no partial EPUB is written
+SCRAPE_FAILED = object()
+
+
+def create_epub(chapter_queue, novel_title, novel_author, output_filename):
     """
-    Creates an EPUB file from the scraped novel data.
+    Creates an EPUB file, adding chapters as they arrive on chapter_queue until it receives None.
+    Returns without writing anything if it receives SCRAPE_FAILED instead.
+    Nothing is written if no chapters arrive.
     """
-    print(f"\nCreating EPUB file: {output_filename}...")
     book = epub.EpubBook()
 
     # Set metadata
@@ -126,19 +289,26 @@ def create_epub(novel_data, novel_title, novel_author, output_filename):
     book.add_author(novel_author)
 
     chapters = []
-    for i, chapter_data in enumerate(novel_data):
+    for i, chapter_data in enumerate(iter(chapter_queue.get, None)):
+        if chapter_data is SCRAPE_FAILED:
+            return
         # Create an EPUB chapter object (EpubHtml)
         c = epub.EpubHtml(title=chapter_data['title'], file_name=f'chap_{i+1}.xhtml', lang='en')
         
-        # Format the content as basic HTML
-        html_content = f"<h1>{chapter_data['title']}</h1>\n"
-        html_content += "".join(f"<p>{line}</p>" for line in chapter_data['content'].split('\n\n'))
+        # Format the content as basic HTML, built in one pass
+        html_parts = ['<h1>', escape(chapter_data['title']), '</h1>\n']
+        html_parts.extend(f"<p>{escape(paragraph)}</p>" for paragraph in chapter_data['content'])
         
-        c.content = html_content
+        c.content = ''.join(html_parts)
         
         book.add_item(c)
         chapters.append(c)
 
+    if not chapters:
+        return
+
+    logger.info("\nCreating EPUB file: %s...", output_filename)
+
     # Define the spine and table of contents
     book.toc = tuple(chapters)
     book.spine = ['nav'] + chapters
@@ -147,46 +317,65 @@ def create_epub(novel_data, novel_title, novel_author, output_filename):
     book.add_item(epub.EpubNcx())
     book.add_item(epub.EpubNav())
 
-    # Write the EPUB file
-    epub.write_epub(output_filename, book, {})
-    print(f"EPUB file '{output_filename}' created successfully.")
+    # Write the EPUB file; the chapters have no page-break markers, so skip ebooklib's scan for them
+    epub.write_epub(output_filename, book, {'epub3_pages': False})
+    logger.info("EPUB file '%s' created successfully.", output_filename)
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Scrape a novel and save as EPUB.")
     parser.add_argument('novel_url', type=str, help='URL of the novel to scrape.')
     parser.add_argument('chapters_to_scrape', type=str, help='Number of chapters to scrape from the start, or "all" for all chapters.')
+    parser.add_argument('--workers', type=int, default=MAX_WORKERS, help=f'Number of chapters to fetch in parallel (default: {MAX_WORKERS}).')
+    parser.add_argument('--rps', type=float, default=REQUESTS_PER_SECOND, help=f'Maximum requests per second, 0 for no limit (default: {REQUESTS_PER_SECOND}).')
     args = parser.parse_args()
+    max_workers = max(1, args.workers)
+    size_connection_pool(max_workers)
+    LIMITER = RateLimiter(args.rps)
+    log_listener = setup_logging()
     
-    novel_title = get_novel_title(args.novel_url)
-    novel_author = "Web Novel Scraper"
+    try:
+        novel_title = get_novel_title(args.novel_url)
+        novel_author = "Web Novel Scraper"
     
-    chapter_urls = get_chapter_links(args.novel_url)
+        chapter_links = get_chapter_links(args.novel_url)
     
-    if chapter_urls:
-        scraped_chapters = []
-        
-        if args.chapters_to_scrape.lower() == 'all':
-            urls_to_scrape = chapter_urls
-        else:
-            try:
-                num_chapters = int(args.chapters_to_scrape)
-                if num_chapters <= 0:
-                    print("Please provide a positive number of chapters.")
+        if chapter_links:
+            if args.chapters_to_scrape.lower() == 'all':
+                links_to_scrape = chapter_links
+            else:
+                try:
+                    num_chapters = int(args.chapters_to_scrape)
+                    if num_chapters <= 0:
+                        logger.error("Please provide a positive number of chapters.")
+                        exit()
+                    links_to_scrape = chapter_links[:num_chapters]
+                except ValueError:
+                    logger.error("Invalid input for number of chapters. Please use a number or 'all'.")
                     exit()
-                urls_to_scrape = chapter_urls[:num_chapters]
-            except ValueError:
-                print("Invalid input for number of chapters. Please use a number or 'all'.")
-                exit()
         
-        print(f"\nStarting to scrape {len(urls_to_scrape)} chapters...")
-        for url in urls_to_scrape:
-            chapter_data = scrape_chapter(url)
-            if chapter_data:
-                scraped_chapters.append(chapter_data)
-        
-        if scraped_chapters:
+            logger.info("\nStarting to scrape %d chapters...", len(links_to_scrape))
+            urls = [url for _, url in links_to_scrape]
+            chapter_nums = [chapter_num for chapter_num, _ in links_to_scrape]
             output_filename = f"{novel_title.replace(' ', '_')}.epub"
-            create_epub(scraped_chapters, novel_title, novel_author, output_filename)
-    else:
-        print("\nFailed to get chapter links. Exiting.")
+            chapter_queue = queue.Queue()
+
+            # Build the EPUB in a background thread while the chapters are still being scraped
+            with ThreadPoolExecutor(max_workers=1) as writer:
+                epub_future = writer.submit(create_epub, chapter_queue, novel_title, novel_author, output_filename)
+                try:
+                    # Fetch the chapters in parallel; map() yields results in chapter order
+                    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                        for chapter_data in executor.map(scrape_chapter, urls, chapter_nums):
+                            if chapter_data:
+                                chapter_queue.put(chapter_data)
+                except BaseException:
+                    chapter_queue.put(SCRAPE_FAILED)  # Tell the writer to give up without saving
+                    raise
+                chapter_queue.put(None)  # Tell the writer there are no more chapters
+                epub_future.result()  # Re-raise any error from the writer
+        else:
+            logger.error("\nFailed to get chapter links. Exiting.")
+    finally:
+        SESSION.close()
+        log_listener.stop()